@@ -3,8 +3,8 @@ from typing import Optional, List
 import asyncio
 import re
 
+import aiohttp
 import vk_api
-from vk_api.bot_longpoll import VkBotLongPoll, VkBotEventType
 
 from src.config import config
 from src.terminal.terminal_manager import TerminalManager
@@ -12,6 +12,9 @@ from src.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Специальные клавиши начинаются с ^ (например, ^C)
+_SPECIAL_KEY_RE = re.compile(r'\^\S+')
+
 class VKTerminalBot:
     """VK Bot for terminal control."""
     
@@ -19,9 +22,18 @@ class VKTerminalBot:
         """Initialize VK bot."""
         self.vk_session = vk_api.VkApi(token=config.vk.token)
         self.vk = self.vk_session.get_api()
-        self.longpoll = VkBotLongPoll(self.vk_session, group_id=config.vk.group_id)
         self.terminal = TerminalManager()
         self._running = False
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Параметры Long Poll переживают переподключения, чтобы не терять события
+        self._longpoll_server: Optional[dict] = None
+        self._longpoll_ts: Optional[str] = None
+        self._outbox: list[str] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._tasks: set[asyncio.Task] = set()
+        self.LONGPOLL_WAIT = 25  # Seconds VK holds an a_check request open
+        self.MAX_CONCURRENT_HANDLERS = 4  # Upper bound on commands waiting for the terminal
+        self._handlers_semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_HANDLERS)
     
     @staticmethod
     def _parse_message(text: str) -> tuple[Optional[str], List[str]]:
@@ -33,34 +45,68 @@ class VKTerminalBot:
         Returns:
             Tuple of (command, special_keys)
         """
-        if not text.startswith(config.vk.bot_tag):
+        tag = config.vk.bot_tag
+
+        # Убираем тег бота; если длина не изменилась, тега в начале не было
+        stripped = text.removeprefix(tag)
+        if tag and len(stripped) == len(text):
             return None, []
+        text = stripped.strip()
         
-        # Убираем тег бота
-        text = text[len(config.vk.bot_tag):].strip()
-        
-        # Ищем специальные клавиши (начинаются с ^)
-        special_keys = re.findall(r'\^[^\s]+', text)
-        
-        # Убираем специальные клавиши из команды
-        command = re.sub(r'\^[^\s]+', '', text).strip()
+        # За один проход собираем специальные клавиши и текст команды без них
+        special_keys = []
+        parts = []
+        last = 0
+        for match in _SPECIAL_KEY_RE.finditer(text):
+            parts.append(text[last:match.start()])
+            special_keys.append(match.group())
+            last = match.end()
+        parts.append(text[last:])
+        command = ''.join(parts).strip()
         
         return command or None, special_keys
     
     def _send_message(self, text: str) -> None:
+        """Queue message for sending to VK chat.
+
+        Messages queued within one event loop tick are coalesced and sent
+        together by a single flush task.
+        
+        Args:
+            text: Message text
+        """
+        self._outbox.append(text)
+        # Если отправка уже идёт, новое сообщение уйдёт следующей пачкой
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_outbox())
+
+    async def _flush_outbox(self) -> None:
+        """Send all queued messages, batching them into as few sends as possible."""
+        # Даём остальным задачам дописать сообщения в текущем такте цикла
+        await asyncio.sleep(0)
+        while self._outbox:
+            text = '\n'.join(self._outbox)
+            self._outbox.clear()
+            await self._deliver_message(text)
+
+    async def _deliver_message(self, text: str) -> None:
         """Send message to VK chat.
         
         Args:
             text: Message text
         """
         # Разбиваем длинные сообщения
-        while text:
-            chunk = text[:config.terminal.max_output_length]
-            text = text[config.terminal.max_output_length:]
-            
+        max_len = config.terminal.max_output_length
+        chunks = [text[i:i + max_len] for i in range(0, len(text), max_len)]
+        peer_id = 2000000000 + config.vk.peer_id
+        send = self.vk.messages.send
+
+        # Отправляем последовательно, чтобы сохранить порядок вывода в чате
+        for chunk in chunks:
             try:
-                self.vk.messages.send(
-                    peer_id=2000000000 + config.vk.peer_id,
+                await asyncio.to_thread(
+                    send,
+                    peer_id=peer_id,
                     message=chunk,
                     random_id=0
                 )
@@ -80,17 +126,22 @@ class VKTerminalBot:
             return
             
         try:
-            # Обрабатываем специальные клавиши
-            for key in special_keys:
-                self.terminal.handle_special_key(key)
-                await asyncio.sleep(0.1)  # Небольшая задержка между клавишами
+            # Специальные клавиши отправляем сразу, не занимая слот обработчика:
+            # ^C должен прервать зависшую команду, даже если за ней стоят другие
+            if special_keys:
+                self.terminal.handle_special_keys(special_keys)
             
             # Выполняем команду, если она есть
             if command:
-                cwd, output = await self.terminal.execute_command(command)
+                async with self._handlers_semaphore:
+                    cwd, output, exit_code = await self.terminal.execute_command(command)
                 
-                # Форматируем ответ
-                response = f"{cwd}> {command}\n{output}"
+                # Форматируем ответ, код выхода показываем только при ошибке
+                status = f" [код {exit_code}]" if exit_code else ""
+                response = f"{cwd}> {command}{status}\n{output}"
+                if exit_code is None:
+                    # Команда не завершилась за отведённое время, вывод может быть неполным
+                    response += "\n⚠️ Превышено время выполнения команды"
                 self._send_message(response)
                 
         except TimeoutError:
@@ -98,6 +149,77 @@ class VKTerminalBot:
         except Exception as e:
             logger.error(f"Error handling message: {e}")
             self._send_message(f"❌ Ошибка: {str(e)}")
+
+    def _schedule_message(self, text: str) -> None:
+        """Schedule message handling without blocking the poll loop.
+
+        Args:
+            text: Message text
+        """
+        task = asyncio.create_task(self._handle_message(text))
+        # Храним ссылку на задачу, чтобы её не собрал GC до завершения
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _get_longpoll_server(self) -> dict:
+        """Request Bots Long Poll server credentials.
+
+        Returns:
+            Dict with server, key and ts
+        """
+        return await asyncio.to_thread(
+            self.vk.groups.getLongPollServer,
+            group_id=config.vk.group_id
+        )
+
+    async def _poll_loop(self) -> None:
+        """Receive events from Bots Long Poll API and dispatch messages."""
+        if self._session is None:
+            raise RuntimeError("HTTP session not started")
+
+        # После сбоя соединения продолжаем с последнего полученного ts
+        if self._longpoll_server is None:
+            self._longpoll_server = await self._get_longpoll_server()
+        if self._longpoll_ts is None:
+            self._longpoll_ts = self._longpoll_server['ts']
+        chat_peer_id = 2000000000 + config.vk.peer_id
+
+        while self._running:
+            server = self._longpoll_server
+            params = {
+                'act': 'a_check',
+                'key': server['key'],
+                'ts': self._longpoll_ts,
+                'wait': self.LONGPOLL_WAIT
+            }
+            async with self._session.get(server['server'], params=params) as response:
+                data = await response.json(content_type=None)
+
+            if failed := data.get('failed'):
+                if failed == 1:
+                    # История событий устарела, продолжаем с нового ts
+                    self._longpoll_ts = data['ts']
+                elif failed == 2:
+                    # Истёк ключ — запрашиваем новый, ts оставляем прежним
+                    logger.info("Long poll key expired, refreshing server")
+                    self._longpoll_server = await self._get_longpoll_server()
+                elif failed == 3:
+                    # Информация потеряна — запрашиваем новые key и ts
+                    logger.info("Long poll information lost, refreshing server")
+                    self._longpoll_server = await self._get_longpoll_server()
+                    self._longpoll_ts = self._longpoll_server['ts']
+                else:
+                    raise RuntimeError(f"Unexpected long poll response: {data}")
+                continue
+
+            self._longpoll_ts = data['ts']
+            for update in data.get('updates', []):
+                if update.get('type') != 'message_new':
+                    continue
+                # Начиная с API 5.103 сообщение вложено в object.message
+                message = update['object'].get('message', update['object'])
+                if message.get('peer_id') == chat_peer_id:
+                    self._schedule_message(message.get('text', ''))
     
     async def start(self) -> None:
         """Start the bot."""
@@ -107,6 +229,9 @@ class VKTerminalBot:
         self._running = True
         
         try:
+            timeout = aiohttp.ClientTimeout(total=self.LONGPOLL_WAIT + 10)
+            self._session = aiohttp.ClientSession(timeout=timeout)
+
             # Запускаем терминал
             await self.terminal.start()
             
@@ -116,10 +241,10 @@ class VKTerminalBot:
             # Основной цикл обработки сообщений
             while self._running:
                 try:
-                    for event in self.longpoll.listen():
-                        if event.type == VkBotEventType.MESSAGE_NEW and event.chat_id == config.vk.peer_id:
-                            await self._handle_message(event.message.text)
+                    await self._poll_loop()
                 except Exception as e:
+                    if not self._running:
+                        break
                     logger.error(f"Error in main loop: {e}")
                     await asyncio.sleep(5)  # Пауза перед повторным подключением
                     
@@ -133,5 +258,18 @@ class VKTerminalBot:
     async def stop(self) -> None:
         """Stop the bot."""
         self._running = False
+
+        for task in list(self._tasks):
+            task.cancel()
+
+        # Дожидаемся отправки уже поставленных в очередь сообщений
+        if self._flush_task is not None:
+            await self._flush_task
+            self._flush_task = None
+
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
         await self.terminal.stop()
         logger.info("Bot stopped")
\ No newline at end of file
@@ -3,11 +3,12 @@ import contextlib
 import pty
 import os
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 import fcntl
 import termios
 import struct
 import signal
+import uuid
 from dataclasses import dataclass
 import re
 from src.config import config
@@ -15,6 +16,32 @@ from src.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+_READ_BUF_SIZE = 65536  # Bytes requested per os.read from the pty
+
+# Управляющие последовательности терминала; все они ASCII, поэтому удаляем их из байтов до декодирования
+_ANSI_BYTES_RE = re.compile(rb'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
+# Строки приглашения шелла
+_PROMPT_RE = re.compile(r'(?:\$ |# |> )')
+# PS1 шелла; строка ровно из приглашения — это оставшийся перед маркером или устаревший промпт
+_PS1 = '$ '
+
+# Простая смена каталога: `cd` или `cd <path>`, где путь состоит только из литеральных символов.
+# Опции (`cd -`, `cd -P`), кавычки, подстановки, шаблоны (`*`, `?`, `[`, `{`), `\\` и особые
+# формы тильды (`~+`, `~-`, `~user`) не совпадают и уходят на проверку через pwd
+_CD_RE = re.compile(r'^\s*cd(?:\s+(~(?:/[\w./@%+,:=-]*)?|[\w./@%+,:=][\w./@%+,:=-]*))?\s*$')
+# Конструкции, после которых каталог шелла нельзя вычислить заранее
+_COMPOUND_MARKERS = (';', '\n', '&&', '||', '`', '$(')
+_DIR_COMMANDS = ('cd', 'pushd', 'popd')
+
+# Маркер завершения команды: __DONE_<tag>_<код выхода>__
+_SENTINEL_PREFIX = '__DONE_'
+_SENTINEL_WINDOW = 64  # Enough to catch a marker split across two reads
+_ANY_SENTINEL_RE = re.compile(rf'{_SENTINEL_PREFIX}[0-9a-f]{{32}}_')
+
+# ^C, ^\ и ^Z: пока readline обрабатывает сигнал, набранный следом ввод может потеряться
+_SIGNAL_KEYS = b'\x03\x1c\x1a'
+
 @dataclass
 class TerminalSize:
     """Terminal size configuration."""
@@ -29,26 +56,37 @@ class TerminalManager:
     def __init__(self, working_dir: Path = config.terminal.working_dir):
         """Initialize terminal manager."""
         self.working_dir = working_dir
+        self._cwd = str(working_dir)  # Tracked shell cwd, avoids a pwd round-trip per command
         self.master_fd: Optional[int] = None
         self.slave_fd: Optional[int] = None
         self.shell_pid: Optional[int] = None
-        self.prompt_markers = ['$ ', '# ', '> ']
         self._process_alive = False
         self._reconnect_lock = asyncio.Lock()
+        self._command_lock = asyncio.Lock()  # One command at a time per shell
+        self._sentinel_echo: Optional[bytes] = None  # Marker line of the command in flight
+        self._needs_reset = False  # Shell is alive but a command failed mid-flight
+        self._needs_sync = False  # A signal key hit the idle prompt; wait for it before the next command
         self._reconnect_attempts = 0
         self.MAX_RECONNECT_ATTEMPTS = 3
         self.READ_TIMEOUT = 0.1  # Timeout for individual read attempts
         self.MAX_READ_RETRIES = 50  # Maximum number of read retries
+        # Pre-encoded internal commands
+        self._PWD_CMD = b"pwd\n"
+        self._SHELL_TEST = b"echo 'shell_test'\n"
         
     async def _ensure_connection(self) -> bool:
         """Ensure terminal connection is alive, attempt reconnection if needed."""
-        if self._process_alive and self.shell_pid:
-            try:
-                os.kill(self.shell_pid, 0)  # Check if process is alive
-                return True
-            except ProcessLookupError:
-                self._process_alive = False
-                logger.warning("Process not found, marking as not alive")
+        if self._process_alive:
+            if self._is_shell_alive():
+                # A live shell only needs its prompt reset, not a new fork+exec
+                if self._needs_reset:
+                    if await self._reset_shell():
+                        return True
+                elif not self._needs_sync or await self._sync_shell():
+                    return True
+            else:
+                logger.warning("Shell process exited, marking as not alive")
+            self._process_alive = False
 
         async with self._reconnect_lock:
             if self._reconnect_attempts >= self.MAX_RECONNECT_ATTEMPTS:
@@ -70,14 +108,67 @@ class TerminalManager:
                 logger.error(f"Failed to reconnect: {e}")
                 return False
         
+    def _is_shell_alive(self) -> bool:
+        """Check whether the shell process is still running, reaping it if it has exited."""
+        if not self.shell_pid:
+            return False
+        try:
+            pid, _ = os.waitpid(self.shell_pid, os.WNOHANG)
+        except ChildProcessError:
+            pid = self.shell_pid
+        if pid == 0:
+            return True
+        # The child is reaped; forget its pid so stop() can't signal a reused one
+        self.shell_pid = None
+        return False
+
+    async def _sync_shell(self, attempts: int = 3, timeout: float = 1) -> bool:
+        """Wait until the shell reads input again by round-tripping a completion marker."""
+        try:
+            for _ in range(attempts):
+                # The marker line itself may lose characters while readline settles, so retry
+                sentinel = self._write_with_sentinel(b"")
+                try:
+                    _, exit_code = await self._read_terminal_output(timeout, sentinel)
+                except TimeoutError:
+                    exit_code = None
+                finally:
+                    self._sentinel_echo = None
+                if exit_code is not None:
+                    self._needs_sync = False
+                    return True
+        except OSError as e:
+            logger.error(f"Failed to sync terminal session: {e}")
+            return False
+        logger.warning("Shell did not return to the prompt")
+        return False
+
+    async def _reset_shell(self) -> bool:
+        """Interrupt whatever is running in the shell and check that the prompt came back."""
+        if self.master_fd is None:
+            return False
+        try:
+            logger.info("Resetting terminal session")
+            os.write(self.master_fd, b'\x03\n')  # Ctrl-C and a fresh prompt
+        except OSError as e:
+            logger.error(f"Failed to reset terminal session: {e}")
+            return False
+        # A program that ignores ^C (a REPL, less, ssh) keeps the marker from coming back;
+        # report failure so the caller restarts the shell instead of typing into it
+        if not await self._sync_shell():
+            return False
+        self._needs_reset = False
+        return True
+
     async def start(self) -> None:
         """Start terminal session with improved error handling."""
         try:
             # Close any existing session
             await self.stop()
+            self._cwd = str(self.working_dir)
 
             self.master_fd, self.slave_fd = pty.openpty()
-            logger.debug(f"Created pty: master_fd={self.master_fd}, slave_fd={self.slave_fd}")
+            logger.debug("Created pty: master_fd=%s, slave_fd=%s", self.master_fd, self.slave_fd)
 
             # Set terminal attributes
             attrs = termios.tcgetattr(self.master_fd)
@@ -86,64 +177,95 @@ class TerminalManager:
 
             self._set_terminal_size(TerminalSize())
 
-            self.shell_pid = os.fork()
-            logger.debug(f"Forked process: pid={self.shell_pid}")
+            # posix_spawn avoids copying the bot's address space; fork is kept for platforms without it
+            if hasattr(os, 'posix_spawn'):
+                self.shell_pid = self._spawn_shell()
+            else:
+                self.shell_pid = self._fork_shell()
+            logger.debug("Started shell process: pid=%s", self.shell_pid)
 
-            if self.shell_pid == 0:  # Child process
-                try:
-                    os.chdir(str(self.working_dir))
-                    os.setsid()
-                    os.dup2(self.slave_fd, 0)
-                    os.dup2(self.slave_fd, 1)
-                    os.dup2(self.slave_fd, 2)
-
-                    if self.master_fd is not None:
-                        os.close(self.master_fd)
-                    if self.slave_fd is not None:
-                        os.close(self.slave_fd)
-
-                    # Set minimal environment
-                    os.environ.clear()
-                    os.environ |= {
-                        'TERM': 'xterm',
-                        'PATH': os.environ.get(
-                            'PATH',
-                            '/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin',
-                        ),
-                        'HOME': os.environ.get('HOME', ''),
-                        'SHELL': config.terminal.shell_path,
-                        'PS1': '$ ',
-                        'LANG': 'en_US.UTF-8',
-                    }
-
-
-                    os.execv(config.terminal.shell_path, [config.terminal.shell_path, '--norc'])
-                except Exception as e:
-                    logger.error(f"Child process failed: {e}")
-                    os._exit(1)
-
-            else:  # Parent process
-                if self.slave_fd is not None:
-                    os.close(self.slave_fd)
-                    self.slave_fd = None
-                self._process_alive = True
+            if self.slave_fd is not None:
+                os.close(self.slave_fd)
+                self.slave_fd = None
+            self._process_alive = True
 
-                # Set non-blocking mode
-                if self.master_fd is not None:
-                    flags = fcntl.fcntl(self.master_fd, fcntl.F_GETFL)
-                    fcntl.fcntl(self.master_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            # Set non-blocking mode
+            if self.master_fd is not None:
+                flags = fcntl.fcntl(self.master_fd, fcntl.F_GETFL)
+                fcntl.fcntl(self.master_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
 
-                # Wait for shell initialization and verify it's working
-                await asyncio.sleep(0.5)
-                if not await self._verify_shell():
-                    raise RuntimeError("Shell initialization failed")
-                await self._clear_initial_output()
+            # Wait for shell initialization and verify it's working
+            await asyncio.sleep(0.5)
+            if not await self._verify_shell():
+                raise RuntimeError("Shell initialization failed")
+            await self._clear_initial_output()
 
         except Exception as e:
             logger.error(f"Failed to start terminal: {e}")
             await self.stop()
             raise
             
+    @staticmethod
+    def _shell_env() -> dict:
+        """Build the minimal environment for the shell process."""
+        return {
+            'TERM': 'xterm',
+            'PATH': os.environ.get(
+                'PATH',
+                '/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin',
+            ),
+            'HOME': os.environ.get('HOME', ''),
+            'SHELL': config.terminal.shell_path,
+            'PS1': '$ ',
+            'LANG': 'en_US.UTF-8',
+        }
+
+    def _spawn_shell(self) -> int:
+        """Start the shell on the pty slave with posix_spawn and return its pid."""
+        file_actions = [
+            (os.POSIX_SPAWN_DUP2, self.slave_fd, 0),
+            (os.POSIX_SPAWN_DUP2, self.slave_fd, 1),
+            (os.POSIX_SPAWN_DUP2, self.slave_fd, 2),
+            (os.POSIX_SPAWN_CLOSE, self.master_fd),
+            (os.POSIX_SPAWN_CLOSE, self.slave_fd),
+        ]
+        # posix_spawn has no cwd argument, so the child inherits it from a temporary chdir
+        previous_cwd = os.getcwd()
+        os.chdir(str(self.working_dir))
+        try:
+            return os.posix_spawn(
+                config.terminal.shell_path,
+                [config.terminal.shell_path, '--norc'],
+                self._shell_env(),
+                file_actions=file_actions,
+                setsid=True,
+            )
+        finally:
+            os.chdir(previous_cwd)
+
+    def _fork_shell(self) -> int:
+        """Start the shell on the pty slave with fork and exec and return its pid."""
+        env = self._shell_env()
+        pid = os.fork()
+        if pid == 0:  # Child process
+            try:
+                os.chdir(str(self.working_dir))
+                os.setsid()
+                os.dup2(self.slave_fd, 0)
+                os.dup2(self.slave_fd, 1)
+                os.dup2(self.slave_fd, 2)
+
+                if self.master_fd is not None:
+                    os.close(self.master_fd)
+                if self.slave_fd is not None:
+                    os.close(self.slave_fd)
+
+                os.execve(config.terminal.shell_path, [config.terminal.shell_path, '--norc'], env)
+            except Exception as e:
+                logger.error(f"Child process failed: {e}")
+                os._exit(1)
+        return pid
+
     async def _verify_shell(self) -> bool:
         """Verify shell is responsive after initialization."""
         try:
@@ -151,43 +273,82 @@ class TerminalManager:
                 return False
 
             # Send a test command
-            test_cmd = "echo 'shell_test'\n"
-            os.write(self.master_fd, test_cmd.encode('utf-8'))
+            os.write(self.master_fd, self._SHELL_TEST)
 
             # Try to read response
-            start_time = asyncio.get_event_loop().time()
-            while asyncio.get_event_loop().time() - start_time < 5:  # 5 second timeout
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + 5  # 5 second timeout
+            while loop.time() < deadline:
                 try:
-                    response = os.read(self.master_fd, 1024).decode('utf-8')
+                    response = os.read(self.master_fd, _READ_BUF_SIZE).decode('utf-8', errors='replace')
                     if 'shell_test' in response:
                         return True
-                except OSError:
-                    await asyncio.sleep(0.1)
+                except BlockingIOError:
+                    await self._wait_readable(deadline - loop.time())
             return False
         except Exception as e:
             logger.error(f"Shell verification failed: {e}")
             return False
     
-    async def _read_terminal_output(self, timeout: int) -> str:
-        """Read terminal output with improved retry mechanism and buffering."""
+    async def _wait_readable(self, timeout: float) -> bool:
+        """Wait until master_fd has data to read or timeout expires.
+
+        Returns:
+            bool: True if the descriptor became readable, False on timeout.
+        """
+        if self.master_fd is None:
+            raise RuntimeError("Terminal file descriptor is None")
+
+        fd = self.master_fd
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+
+        def on_readable() -> None:
+            if not ready.done():
+                ready.set_result(None)
+
+        loop.add_reader(fd, on_readable)
+        try:
+            await asyncio.wait_for(ready, max(timeout, 0))
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            loop.remove_reader(fd)
+
+    async def _read_terminal_output(
+        self, timeout: int, sentinel: Optional[re.Pattern] = None
+    ) -> Tuple[str, Optional[int]]:
+        """
+        Read terminal output with improved retry mechanism and buffering.
+
+        Without a sentinel, reading stops after 2 seconds of silence. With a
+        sentinel, reading stops as soon as it appears in the output, and the
+        output is cut at the marker.
+
+        Returns:
+        Tuple[str, Optional[int]]: Output without ANSI sequences, and the exit code
+        reported by the sentinel (None if there is no sentinel or it wasn't seen).
+        """
         if not self.master_fd or not self._process_alive:
             raise RuntimeError("Terminal not started or process not alive")
 
         output_chunks = []
-        start_time = asyncio.get_event_loop().time()
-        last_read_time = start_time
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        idle_deadline = deadline  # Moved to 2 seconds after each successful read
         retry_count = 0
-        buffer = bytearray()
+        carry = b''
 
         while True:
-            current_time = asyncio.get_event_loop().time()
+            current_time = loop.time()
 
-            if current_time - start_time > timeout:
+            if current_time > deadline:
                 if not output_chunks:
                     raise TimeoutError(f"Command execution timeout ({timeout}s) with no data received")
                 break
 
-            if current_time - last_read_time > 2 and output_chunks:
+            if sentinel is None and current_time > idle_deadline and output_chunks:
                 # We have some data and haven't received more in 2 seconds
                 break
 
@@ -195,15 +356,15 @@ class TerminalManager:
                 if self.master_fd is None:
                     raise RuntimeError("Terminal file descriptor is None")
 
-                if chunk := os.read(self.master_fd, 4096):
-                    buffer.extend(chunk)
-                    # Try to decode complete UTF-8 sequences
-                    with contextlib.suppress(UnicodeDecodeError):
-                        text = buffer.decode('utf-8')
-                        output_chunks.append(text)
-                        buffer.clear()
-                        last_read_time = current_time
-                        retry_count = 0  # Reset retry count on successful read
+                if chunk := os.read(self.master_fd, _READ_BUF_SIZE):
+                    output_chunks.append(chunk)
+                    if sentinel is not None:
+                        window = carry + chunk
+                        if sentinel.search(window):
+                            break
+                        carry = window[-_SENTINEL_WINDOW:]
+                    idle_deadline = current_time + 2
+                    retry_count = 0  # Reset retry count on successful read
                 else:
                     retry_count += 1
                     if retry_count >= self.MAX_READ_RETRIES:
@@ -213,18 +374,28 @@ class TerminalManager:
                     await asyncio.sleep(self.READ_TIMEOUT)
 
             except BlockingIOError:
-                await asyncio.sleep(self.READ_TIMEOUT)
+                # Wait for readiness instead of sleeping a fixed interval
+                wait_until = deadline
+                if sentinel is None and output_chunks:
+                    wait_until = min(deadline, idle_deadline)
+                await self._wait_readable(wait_until - current_time)
             except OSError as e:
                 logger.error(f"Error reading from terminal: {e}")
                 break
 
-        # Handle any remaining buffer content
-        if buffer:
-            output_chunks.append(buffer.decode('utf-8', errors='replace'))
+        raw = b''.join(output_chunks)
+        exit_code = None
+        if sentinel is not None and (match := sentinel.search(raw)):
+            raw = raw[:match.start()]
+            exit_code = int(match.group(1))
 
-        return ''.join(output_chunks)
+        # Decode once, after the (ASCII-only) escape sequences are gone
+        output = _ANSI_BYTES_RE.sub(b'', raw).decode('utf-8', errors='replace')
+        return output, exit_code
 
-    async def execute_command(self, command: str, timeout: int = config.terminal.command_timeout) -> Tuple[str, str]:
+    async def execute_command(
+        self, command: str, timeout: int = config.terminal.command_timeout
+    ) -> Tuple[str, str, Optional[int]]:
         """
         Execute command with automatic reconnection and improved error handling.
 
@@ -233,65 +404,150 @@ class TerminalManager:
         timeout (int, optional): The timeout for command execution. Defaults to the value specified in the config.
 
         Returns:
-        Tuple[str, str]: A tuple containing the current working directory and the cleaned output of the command.
+        Tuple[str, str, Optional[int]]: A tuple containing the current working directory, the cleaned output
+        of the command and its exit code (None if the command didn't finish within the timeout).
 
         Raises:
         RuntimeError: If the terminal connection cannot be established.
         OSError: If an error occurs while reading from or writing to the terminal.
         """
+        async with self._command_lock:
+            return await self._execute_command_locked(command, timeout)
+
+    async def _execute_command_locked(self, command: str, timeout: int) -> Tuple[str, str, Optional[int]]:
+        """Execute command; caller must hold the command lock."""
         for attempt in range(2):  # Try twice: initial attempt + one retry
             try:
                 if not await self._ensure_connection():
                     raise RuntimeError("Failed to establish terminal connection")
 
-                logger.debug(f"Executing command (attempt {attempt + 1}): {command}")
-
-                # Clear output before executing command
-                await self._clear_initial_output()
+                logger.debug("Executing command (attempt %d): %s", attempt + 1, command)
 
                 if self.master_fd is None:
                     raise RuntimeError("Terminal file descriptor is None")
 
-                self._send_command_to_terminal(command)
-                output = await self._retrieve_command_output(timeout)
+                cd_target = self._resolve_cd_target(command)
+
+                sentinel = self._send_command_to_terminal(command)
+                output, exit_code = await self._retrieve_command_output(timeout, sentinel)
+                if exit_code is None:
+                    # Still running past the timeout; interrupt it before the next command
+                    self._needs_reset = True
 
                 # Get current directory
-                cwd = await self._get_current_directory()
+                if cd_target is not None:
+                    # Trust the shell's own verdict on the cd, not a check from the bot process
+                    if exit_code == 0:
+                        self._cwd = cd_target
+                    cwd = self._cwd
+                elif exit_code is not None and self._may_change_directory(command):
+                    cwd = await self._get_current_directory()
+                else:
+                    cwd = self._cwd
 
                 # Clean output
-                cleaned_output = self._clean_output(command, output)
+                cleaned_output = self._clean_output(output)
                 self._validate_cleaned_output(cleaned_output, output)
 
-                return cwd, cleaned_output
+                return cwd, cleaned_output, exit_code
 
             except (OSError, RuntimeError) as e:
                 logger.error(f"Command execution failed (attempt {attempt + 1}): {e}")
+                self._needs_reset = True
                 if attempt == 0:  # Only attempt reconnection on the first failure
                     await asyncio.sleep(1)  # Wait before retrying
                     continue
                 raise
 
-    def _send_command_to_terminal(self, command: str) -> None:
-        """Send the command to the terminal."""
-        cmd_bytes = (command + "\n").encode('utf-8')
+    def handle_special_keys(self, keys: List[str]) -> None:
+        """
+        Send special keys to the terminal as a single write.
+
+        Parameters:
+        keys (List[str]): Keys in caret notation, e.g. ``^C`` or ``^D``.
+
+        Raises:
+        ValueError: If a key is not a valid control character.
+        RuntimeError: If the terminal is not running or the write is incomplete.
+        """
+        if self.master_fd is None or not self._process_alive:
+            raise RuntimeError("Terminal not started or process not alive")
+
+        # Translate everything first so an invalid key doesn't send a partial sequence
+        payload = b''.join(self._special_key_to_bytes(key) for key in keys)
+        if self._sentinel_echo is not None:
+            # ^C flushes typed-ahead input and ^D may end a program that swallowed it,
+            # so repeat the marker to let the running command's read finish
+            payload += self._sentinel_echo
+        elif any(byte in _SIGNAL_KEYS for byte in payload):
+            self._needs_sync = True
+        written = os.write(self.master_fd, payload)
+        if written != len(payload):
+            raise RuntimeError(f"Failed to write special keys: wrote {written} of {len(payload)} bytes")
+        logger.debug("Wrote %d special key bytes to terminal", written)
+
+    @staticmethod
+    def _special_key_to_bytes(key: str) -> bytes:
+        """Convert a caret-notation key (``^C``) to its control byte."""
+        char = key[1:].upper()
+        if char == '?':
+            return b'\x7f'  # DEL
+        if len(char) == 1 and '@' <= char <= '_':
+            return bytes([ord(char) - 0x40])
+        raise ValueError(f"Unknown special key: {key}")
+
+    def _resolve_cd_target(self, command: str) -> Optional[str]:
+        """Return the directory a simple `cd` command switches to, or None if it is not one."""
+        match = _CD_RE.match(command)
+        if match is None:
+            return None
+        target = os.path.expanduser(match.group(1) or '~')
+        return os.path.normpath(os.path.join(self._cwd, target))
+
+    @staticmethod
+    def _may_change_directory(command: str) -> bool:
+        """Check whether the command may change cwd in a way that can't be tracked locally."""
+        if any(marker in command for marker in _COMPOUND_MARKERS):
+            return True
+        words = command.split(maxsplit=1)
+        return bool(words) and words[0] in _DIR_COMMANDS
+
+    def _send_command_to_terminal(self, command: str) -> re.Pattern:
+        """Send the command to the terminal followed by a completion marker."""
+        return self._write_with_sentinel(command.encode('utf-8') + b"\n")
+
+    def _write_with_sentinel(self, cmd_bytes: bytes) -> re.Pattern:
+        """
+        Write an encoded command line to the terminal followed by a completion marker.
+
+        Returns:
+        re.Pattern: Pattern matching the marker; group 1 is the exit code.
+        """
+        tag = f"{_SENTINEL_PREFIX}{uuid.uuid4().hex}_"
+        self._sentinel_echo = f"echo {tag}$?__\n".encode('utf-8')
+        cmd_bytes += self._sentinel_echo
         written = os.write(self.master_fd, cmd_bytes)
         if written != len(cmd_bytes):
             raise RuntimeError(f"Failed to write complete command: wrote {written} of {len(cmd_bytes)} bytes")
-        logger.debug(f"Wrote {written} bytes to terminal")
+        logger.debug("Wrote %d bytes to terminal", written)
+        # Matches only the expanded marker, never the unexpanded `$?` of an echoed command line
+        return re.compile(rf'{tag}(\d+)__'.encode('ascii'))
 
-    async def _retrieve_command_output(self, timeout: int) -> str:
+    async def _retrieve_command_output(self, timeout: int, sentinel: re.Pattern) -> Tuple[str, Optional[int]]:
         """Read command output with improved error handling."""
         try:
-            return await self._read_terminal_output(timeout)
+            return await self._read_terminal_output(timeout, sentinel)
         except TimeoutError:
             logger.error(f"Command timed out after {timeout} seconds")
             raise
+        finally:
+            self._sentinel_echo = None
 
     def _validate_cleaned_output(self, cleaned: str, output: str) -> None:
         """Validate cleaned output and log any potential issues."""
         if not cleaned and output:  # We have output but nothing after cleaning
             logger.warning("Output was completely cleaned away, might indicate an issue")
-        logger.debug(f"Cleaned output: {repr(cleaned)}")
+        logger.debug("Cleaned output: %r", cleaned)
 
 
     def _set_terminal_size(self, size: TerminalSize) -> None:
@@ -306,14 +562,15 @@ class TerminalManager:
             return
 
         try:
-            start_time = asyncio.get_event_loop().time()
-            while asyncio.get_event_loop().time() - start_time < 1:  # 1 second timeout
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + 1  # 1 second timeout
+            while loop.time() < deadline:
                 try:
-                    chunk = os.read(self.master_fd, 4096)
+                    chunk = os.read(self.master_fd, _READ_BUF_SIZE)
                     if not chunk:
                         break
-                except OSError:
-                    await asyncio.sleep(0.1)
+                except BlockingIOError:
+                    await self._wait_readable(deadline - loop.time())
         except Exception as e:
             logger.error(f"Error clearing output: {e}")
     
@@ -322,6 +579,9 @@ class TerminalManager:
         if self.shell_pid:
             with contextlib.suppress(ProcessLookupError):
                 os.kill(self.shell_pid, signal.SIGKILL)
+            # Reap the child so it doesn't linger as a zombie
+            with contextlib.suppress(ChildProcessError):
+                os.waitpid(self.shell_pid, 0)
                 
         if self.master_fd is not None:
             try:
@@ -339,42 +599,42 @@ class TerminalManager:
         self.slave_fd = None
         self.shell_pid = None
         self._process_alive = False
+        self._needs_reset = False
+        self._needs_sync = False
         logger.info("Terminal session stopped")
     
     async def _get_current_directory(self) -> str:
         """Get current working directory in the terminal."""
         # Using a simplified approach to avoid recursion
         if self.master_fd is not None:
-            cmd = "pwd\n"
-            os.write(self.master_fd, cmd.encode('utf-8'))
             try:
-                output = await self._read_terminal_output(5)  # Short timeout for pwd
-                if cleaned := self._clean_output(cmd, output):
-                    return cleaned.strip()
+                sentinel = self._write_with_sentinel(self._PWD_CMD)
+                output, _ = await self._retrieve_command_output(5, sentinel)  # Short timeout for pwd
+                if cleaned := self._clean_output(output):
+                    self._cwd = cleaned.strip()
+                    return self._cwd
             except Exception as e:
                 logger.error(f"Error getting current directory: {e}")
-        return str(self.working_dir)
+        return self._cwd
     
-    def _clean_output(self, command: str, output: str) -> str:
-        """Clean command output from prompts and other artifacts."""
+    def _clean_output(self, output: str) -> str:
+        """
+        Clean command output from prompts and other artifacts.
+
+        ECHO is off on the pty and the sentinel marks where output ends, so there is
+        no command echo to skip; stale prompts and markers are filtered line by line.
+        """
         if not output:
             return ""
 
-        # Удаление управляющих последовательностей терминала
-        ansi_escape = re.compile(r'(?:\x1B[@-Z\\-_]|\x1B\[?.*?[ -/]*[@-~])')
-        cleaned_output = ansi_escape.sub('', output)
-
-        lines = cleaned_output.splitlines()
-
-        # Remove the command line itself
-        if lines and command in lines[0]:
-            lines = lines[1:]
+        # Управляющие последовательности уже удалены в _read_terminal_output
+        lines = output.splitlines()
 
-        # Filter out prompt lines and empty lines
-        cleaned = []
-        for line in lines:
-            line = line.strip()
-            if line and all(marker not in line for marker in self.prompt_markers):
-                cleaned.append(line)
+        # Filter out prompt lines and empty lines; a bare prompt is matched before strip()
+        # so that real output lines consisting of just `$`, `#` or `>` are kept
+        cleaned = [
+            line for line in (raw.strip() for raw in lines if raw != _PS1)
+            if line and not _PROMPT_RE.search(line) and not _ANY_SENTINEL_RE.search(line)
+        ]
 
         return '\n'.join(cleaned)
\ No newline at end of file
@@ -1,45 +1,59 @@
 """Logging configuration module."""
 import logging
+import logging.handlers
 from pathlib import Path
-from typing import Optional
 
 from src.config import config
 
-_logger: Optional[logging.Logger] = None
+# Ограничение размера лог-файла и количества архивных копий
+_LOG_MAX_BYTES = 10 * 1024 * 1024
+_LOG_BACKUP_COUNT = 5
+
+_configured = False
+
+def _configure_root() -> None:
+    """Attach file and console handlers to the root logger."""
+    # Создаем директорию для логов, если её нет
+    log_path = Path(config.log.file)
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Настраиваем формат
+    formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # Настраиваем вывод в файл с ротацией
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_path,
+        maxBytes=_LOG_MAX_BYTES,
+        backupCount=_LOG_BACKUP_COUNT,
+        encoding='utf-8'
+    )
+    file_handler.setFormatter(formatter)
+
+    # Настраиваем вывод в консоль
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+
+    # Обработчики вешаем только на корневой логгер, модульные логгеры передают ему записи
+    root = logging.getLogger()
+    root.setLevel(config.log.level)
+    root.addHandler(file_handler)
+    root.addHandler(console_handler)
 
 def get_logger(name: str) -> logging.Logger:
     """Get configured logger instance.
-    
+
     Args:
         name: Logger name
-        
+
     Returns:
         Configured logger instance
     """
-    global _logger
-    
-    if _logger is None:
-        # Создаем директорию для логов, если её нет
-        log_path = Path(config.log.file)
-        log_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        # Настраиваем формат
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        
-        # Настраиваем вывод в файл
-        file_handler = logging.FileHandler(config.log.file)
-        file_handler.setFormatter(formatter)
-        
-        # Настраиваем вывод в консоль
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        
-        # Создаем и настраиваем логгер
-        _logger = logging.getLogger(name)
-        _logger.setLevel(config.log.level)
-        _logger.addHandler(file_handler)
-        _logger.addHandler(console_handler)
-    
-    return _logger
\ No newline at end of file
+    global _configured
+
+    if not _configured:
+        _configure_root()
+        _configured = True
+
+    return logging.getLogger(name)